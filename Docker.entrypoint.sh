@@ -1,4 +1,4 @@
 #!/bin/sh
 set -e
 cd /
-python -m app.PoolAccessMqttBridge --config=/data/options.json
+exec python -m app.PoolAccessMqttBridge --config=/data/options.json
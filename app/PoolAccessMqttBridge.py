@@ -12,27 +12,41 @@ Options:
 
 """
 
-import importlib
 import json
 import logging
 import os
 import re
+import signal
 import threading
 import sys
-import time
 from json import JSONDecodeError
 
 from docopt import docopt
-from paho.mqtt.client import MQTTMessage, MQTT_ERR_SUCCESS
+from paho.mqtt.client import MQTTMessage
 
 from app.Translation import LanguageManager
 from .hass.Switch import Switch
 from .hass.BayrolPoolaccessDevice import BayrolPoolaccessDevice
 from .hass.Entity import Entity
+from .hass.MessagesSensor import MessagesSensor
+from .hass.Sensor import Sensor
+from .hass.Update import Update
 from .mqtt.MqttClient import MqttClient
 from .mqtt.PoolAccessClient import PoolAccessClient
+from .utils.Utils import json_loads
 
-DEFAULT_RECONNECT_DELAY = 30
+# Home Assistant entity classes available in entities file
+_HASS_CLASSES = {cls.__name__: cls for cls in (Sensor, MessagesSensor, Switch, Update)}
+
+# Delay (in seconds) during which entity states are coalesced before being published to brocker
+DEFAULT_PUBLISH_DELAY = 0.1
+
+# Suffix of brocker command topics
+SET_TOPIC_SUFFIX = "/set"
+
+# CONNACK reasons for which retrying to connect is pointless
+FATAL_CONNECT_REASONS = ("Unsupported protocol version", "Client identifier not valid", "Bad user name or password",
+                         "Not authorized", "Banned", "Bad authentication method")
 
 
 class PoolAccessMqttBridge:
@@ -48,129 +62,160 @@ class PoolAccessMqttBridge:
                  brocker_client: MqttClient):
         # Logger
         self._logger = logging.getLogger()
-        self._reconnect_delay = DEFAULT_RECONNECT_DELAY
+        # Set once the bridge is stopped, failed if it stopped because of a connection failure
+        self._stopped = threading.Event()
+        self._failed = False
+        # Entity states waiting to be published to brocker, by entity uid (last value wins)
+        self._publish_delay = DEFAULT_PUBLISH_DELAY
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._pending_timer = None
         # Mqtt base topic
         self._mqtt_base_topic = mqtt_base_topic
         # Home Assistant Entities
         self._hass_entities = hass_entities
+        # Entities lookup tables, passed to client callbacks as userdata
+        self._by_uid = {e.uid: e for e in hass_entities}
+        self._by_key = {e.key: e for e in hass_entities}
+        # Switches, whose command topics are subscribed on brocker
+        self._switches = [e for e in hass_entities if isinstance(e, Switch)]
         # Mqtt Clients
         self._poolaccess_client = poolaccess_client
         self._brocker_client = brocker_client
         # Device Serial
         self._poolaccess_device_serial = poolaccess_device_serial
+        # PoolAccess value topics prefix
+        self._v_prefix = "d02/%s/v/" % poolaccess_device_serial
+        # PoolAccess get messages, published on connect
+        self._pub_g_list = [("d02/%s/g/%s" % (poolaccess_device_serial, e.uid), e.get_payload(), 0, False)
+                            for e in hass_entities]
+        # PoolAccess set topics by entity uid
+        self._set_topics = {e.uid: "d02/%s/s/%s" % (poolaccess_device_serial, e.uid) for e in hass_entities}
 
     def on_poolaccess_message(self, client: PoolAccessClient, userdata, message: MQTTMessage):
         if not message or message.payload is None or message.topic is None:
             return
-        self._logger.debug("[poolaccess] message [%s][%s]", str(message.topic), str(message.payload))
-        for e in self._hass_entities:  # type: Entity
-            if re.match(".+/v/%s$" % e.uid, message.topic):
-                self._logger.info("Reading %s %s", message.topic, str(message.payload))
-                try:
-                    payload = e.get_payload(message.payload)
-                    self._brocker_client.publish(e.state_topic, payload, message.qos, retain=True)
-                    self._logger.info("Publishing to brocker %s %s", e.state_topic, str(payload))
-                except JSONDecodeError as e:
-                    self._logger.error(e)
+        self._dispatch_v(userdata, message.topic, message.payload, message.qos)
+
+    def _dispatch_v(self, by_uid: dict[str, Entity], topic: str, payload: bytes, qos: int):
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("[poolaccess] message [%s][%s]", topic, payload)
+        v_prefix = self._v_prefix
+        if not topic.startswith(v_prefix):
+            return
+        e = by_uid.get(topic[len(v_prefix):])  # type: Entity
+        if e is None:
+            return
+        self._logger.info("Reading %s %s", topic, payload)
+        try:
+            payload = e.get_payload(payload)
+        except JSONDecodeError as ex:
+            self._logger.error(ex)
+            return
+        with self._pending_lock:
+            self._pending[e.uid] = (e.state_topic, payload, qos, True)
+            if self._pending_timer is None:
+                self._pending_timer = threading.Timer(self._publish_delay, self._flush_pending)
+                self._pending_timer.daemon = True
+                self._pending_timer.start()
+
+    def _flush_pending(self):
+        # Publishing under the lock keeps brocker states ordered with _dispatch_set (paho publish only queues packets)
+        with self._pending_lock:
+            if self._pending_timer is not None:
+                self._pending_timer.cancel()
+                self._pending_timer = None
+            messages = list(self._pending.values())
+            self._pending.clear()
+            if not messages:
+                return
+            for (topic, payload, qos, retain) in messages:
+                self._logger.info("Publishing to brocker %s %s", topic, payload)
+            self._brocker_client.publish_batch(messages)
 
     def on_poolaccess_connect(self, client: PoolAccessClient, userdata, flags, rc, properties):
         if rc == 0:
-            self._logger.info("[poolaccess] connect: [%s][%s][%s]", str(rc), str(userdata), str(flags))
+            self._logger.info("[poolaccess] connect: [%s][%s]", str(rc), str(flags))
             # Subscribing to PoolAccess Messages
-            topic = "d02/%s/v/#" % self._poolaccess_device_serial
+            topic = "%s#" % self._v_prefix
             self._logger.info("Subscribing to topic: %s", topic)
             self._poolaccess_client.subscribe(topic)
 
-            # Looping on entities
+            # Publish entities config to Brocker
+            brocker_messages = []
             for e in self._hass_entities:  # type: Entity
-                # Publish entity config to Brocker
-                (topic, cfg) = e.build_config()
-                payload = str(json.dumps(cfg))
+                (topic, payload) = e.get_config()
                 self._logger.info("Publishing to brocker: %s %s", topic, payload)
-                self._brocker_client.publish(topic, payload=payload, retain=True)
+                brocker_messages.append((topic, payload, 0, True))
+            self._brocker_client.publish_batch(brocker_messages)
 
-                # Publish Get topic to Poolaccess
-                topic = "d02/%s/g/%s" % (self._poolaccess_device_serial, e.uid)
+            # Publish entities get topics to Poolaccess
+            for (topic, payload, qos, retain) in self._pub_g_list:
                 self._logger.info("Publishing to poolaccess: %s", topic)
-                self._poolaccess_client.publish(topic, payload=e.get_payload())
+            self._poolaccess_client.publish_batch(self._pub_g_list)
         else:
-            self._logger.info("[poolaccess] connect: Connection failed [%s]", str(rc))
-            exit(1)
+            self._connect_failed("poolaccess", rc)
 
     def on_brocker_connect(self, client: MqttClient, userdata, flags, rc, properties):
         if rc == 0:
-            self._logger.info("[mqtt] connect: [%s][%s][%s]", str(rc), str(userdata), str(flags))
-            # Looping on entities
-            for e in self._hass_entities:  # type: Entity
-                if isinstance(e, Switch):
-                    # Subscribing to Entity Messages
-                    self._logger.info("Subscribing to topic: %s", e.command_topic)
-                    self._brocker_client.subscribe(e.command_topic)
+            self._logger.info("[mqtt] connect: [%s][%s]", str(rc), str(flags))
+            # Subscribing to Switches Messages within a single SUBSCRIBE packet
+            topics = [(e.command_topic, 0) for e in self._switches]
+            if topics:
+                self._logger.info("Subscribing to topics: %s", ", ".join(t for (t, qos) in topics))
+                self._brocker_client.subscribe(topics)
         else:
-            self._logger.info("[mqtt] connect: Connection failed [%s]", str(rc))
-            exit(1)
+            self._connect_failed("mqtt", rc)
+
+    def _connect_failed(self, name: str, rc):
+        # paho retries refused connections with its reconnect backoff : only give up when retrying is pointless
+        if str(rc) in FATAL_CONNECT_REASONS:
+            self._logger.error("[%s] connect: Connection refused [%s] : stopping", name, str(rc))
+            self._failed = True
+            self._stopped.set()
+        else:
+            self._logger.warning("[%s] connect: Connection failed [%s] : retrying ...", name, str(rc))
 
     def on_brocker_message(self, client: MqttClient, userdata, message: MQTTMessage):
-        self._logger.info("[mqtt] message [%s][%s]", str(message.topic), str(message.payload))
+        self._logger.info("[mqtt] message [%s][%s]", message.topic, message.payload)
         # only dealing with set commands
         if not (message
                 and message.payload
                 and message.topic
-                and message.topic.endswith("/set")):
+                and message.topic.endswith(SET_TOPIC_SUFFIX)):
             return
+        self._dispatch_set(userdata, message.topic, message.payload)
+
+    def _dispatch_set(self, by_key: dict[str, Entity], topic: str, payload: bytes):
         # finding corresponding entity and publishing to poolaccess client
-        for e in self._hass_entities:  # type: Entity
-            if re.match(".+/%s/set$" % e.key, message.topic):
-                # Publish data to brocker to persist it
-                topic = e.state_topic
-                payload = message.payload
-                self._logger.info("Publishing to brocker %s %s", topic, payload)
-                self._brocker_client.publish(topic, payload=payload, retain=True)
-                # Publish data to poolaccess
-                topic = "d02/%s/s/%s" % (self._poolaccess_device_serial, e.uid)
-                payload = message.payload
-                self._logger.info("Publishing to poolaccess %s %s", topic, payload)
-                self._poolaccess_client.publish(topic, payload=payload)
+        # <base>/<key>/set : drop the "/set" suffix and keep the last level
+        e = by_key.get(topic[:-len(SET_TOPIC_SUFFIX)].rpartition("/")[2])  # type: Entity
+        if e is None:
+            return
+        # Publish data to brocker to persist it : a pending poolaccess state is older and must not overwrite it
+        with self._pending_lock:
+            self._pending.pop(e.uid, None)
+            self._logger.info("Publishing to brocker %s %s", e.state_topic, payload)
+            self._brocker_client.publish(e.state_topic, payload=payload, retain=True)
+        # Publish data to poolaccess
+        topic = self._set_topics[e.uid]
+        self._logger.info("Publishing to poolaccess %s %s", topic, payload)
+        self._poolaccess_client.publish(topic, payload=payload)
 
     def on_disconnect(self, client, userdata, flags, rc, properties):
-        self._logger.warning("[mqtt] disconnect: %s  [%s][%s][%s]", type(client).__name__, str(rc), str(userdata),
-                             str(flags))
-
-    def _multi_loop(self, loop=True, timeout=1):
-        while True:
-            brocker_status = self._brocker_client.loop(timeout)
-            poolaccess_status = self._poolaccess_client.loop(timeout)
-
-            if brocker_status != MQTT_ERR_SUCCESS:
-                self._logger.warning("Brocker Client has been disconnected [status: %s] : trying to reconnect ...",
-                                     brocker_status)
-                try:
-                    self._brocker_client.reconnect()
-                except Exception as e:
-                    self._logger.error("Reconnect exception occurred %s ...", str(e))
-                self._logger.info("Waiting %ss ...", str(self._reconnect_delay))
-                time.sleep(self._reconnect_delay)
-
-            if poolaccess_status != MQTT_ERR_SUCCESS:
-                self._logger.warning("Poolaccess Client has been disconnected [status: %s] : trying to reconnect ...",
-                                     poolaccess_status)
-                try:
-                    self._poolaccess_client.reconnect()
-                except Exception as e:
-                    self._logger.error("Reconnect exception occurred %s ...", str(e))
-                self._logger.info("Waiting %ss ...", str(self._reconnect_delay))
-                time.sleep(self._reconnect_delay)
-
-            # loop exit condition
-            if not loop:
-                break
-
-    def start(self):
+        if rc == 0:
+            self._logger.info("[mqtt] disconnect: %s  [%s][%s]", type(client).__name__, str(rc), str(flags))
+        else:
+            self._logger.warning("[mqtt] disconnect: %s  [%s][%s] : reconnecting ...", type(client).__name__,
+                                 str(rc), str(flags))
+
+    def start(self) -> bool:
         connection_success = True
         # PoolAccess setup
         self._poolaccess_client.on_message = self.on_poolaccess_message
         self._poolaccess_client.on_connect = self.on_poolaccess_connect
         self._poolaccess_client.on_disconnect = self.on_disconnect
+        self._poolaccess_client.user_data_set(self._by_uid)
         if self._poolaccess_client.establish_connection() != 0:
             self._logger.error("Poolaccess connection failure !")
             connection_success = False
@@ -179,15 +224,38 @@ class PoolAccessMqttBridge:
         self._brocker_client.on_connect = self.on_brocker_connect
         self._brocker_client.on_message = self.on_brocker_message
         self._brocker_client.on_disconnect = self.on_disconnect
+        self._brocker_client.user_data_set(self._by_key)
         if self._brocker_client.establish_connection() != 0:
             self._logger.error("MQTT Brocker connection failure !")
             connection_success = False
 
-        # Multithreading startup if connection_success
+        # Network loops startup if connection_success : each client runs in its own paho thread
+        # and reconnects by itself with an exponential backoff
         if connection_success:
-            self._logger.info("Starting Multithreading")
-            t = threading.Thread(target=self._multi_loop, args=())  # start multi loop
-            t.start()
+            self._logger.info("Starting network loops")
+            self._brocker_client.loop_start()
+            self._poolaccess_client.loop_start()
+        else:
+            self._failed = True
+            self._stopped.set()
+        return connection_success
+
+    @property
+    def failed(self) -> bool:
+        return self._failed
+
+    def wait(self, timeout: float = None) -> bool:
+        # paho network threads are daemons : block until the bridge is stopped
+        return self._stopped.wait(timeout)
+
+    def stop(self):
+        # Stop receiving poolaccess states first, then publish pending ones before disconnecting brocker
+        self._poolaccess_client.disconnect()
+        self._poolaccess_client.loop_stop()
+        self._flush_pending()
+        self._brocker_client.disconnect()
+        self._brocker_client.loop_stop()
+        self._stopped.set()
 
 
 def load_entities(filepath: str, config) -> []:
@@ -196,25 +264,19 @@ def load_entities(filepath: str, config) -> []:
     device = BayrolPoolaccessDevice(config["DEVICE_SERIAL"])
     hass_discovery_prefix = config["HASS_DISCOVERY_PREFIX"] if "HASS_DISCOVERY_PREFIX" in config else "homeassistant"
     entities = []
-    with open(filepath, 'r') as fp:
+    with open(filepath, 'r', encoding='utf-8') as fp:
         content = fp.read()
-        # Replace config value in entities file
-        for k in config:
-            content = content.replace("#%s" % k, str(config[k]))
-        # Instanciate entities
-        for e in json.loads(content):
-            if "disabled" in e and e["disabled"]:
-                continue
-            class_type = "Sensor"
-            if "__class__" in e:
-                class_type = e["__class__"]
-                del e["__class__"]
-            # Load module
-            hass_module = importlib.import_module("app.hass.%s" % class_type)
-            # Get class
-            hass_class = getattr(hass_module, class_type)
-            # Instantiate the class (pass arguments to the constructor, if needed)
-            entities.append(hass_class(e, device, hass_discovery_prefix))
+    # Replace config values in entities file in a single pass (longest keys first)
+    pattern = re.compile("#(%s)" % "|".join(re.escape(k) for k in sorted(config, key=len, reverse=True)))
+    content = pattern.sub(lambda m: str(config[m.group(1)]), content)
+    # Instanciate entities
+    for e in json_loads(content):
+        if "disabled" in e and e["disabled"]:
+            continue
+        # Get class (Sensor by default)
+        hass_class = _HASS_CLASSES[e.pop("__class__", "Sensor")]
+        # Instantiate the class (pass arguments to the constructor, if needed)
+        entities.append(hass_class(e, device, hass_discovery_prefix))
     return entities
 
 
@@ -235,6 +297,14 @@ def main(config: dict):
         brocker_client
     )
     bridge.start()
+    try:
+        bridge.wait()
+    except KeyboardInterrupt:
+        logger.info("Interrupted")
+    logger.info("Stopping Bridge")
+    bridge.stop()
+    if bridge.failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -247,4 +317,7 @@ if __name__ == "__main__":
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG, format='%(asctime)s :: %(levelname)s :: %(message)s')
     logging.getLogger().setLevel('DEBUG' if args['--debug'] else c["LOG_LEVEL"])
 
+    # Stop cleanly on SIGTERM (docker stop) as on Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
     main(c)
@@ -4,6 +4,7 @@ from datetime import datetime
 
 from .BayrolPoolaccessDevice import BayrolPoolaccessDevice
 from ..Translation import LanguageManager
+from ..utils.Utils import json_dumps
 
 
 def norm(s: str):
@@ -19,6 +20,8 @@ def load_attr(key: str, data: dict):
 
 
 class Entity:
+    __slots__ = ("_uid", "_key", "_attributes", "_device", "_discovery_prefix", "_lang", "_config")
+
     def __init__(self, data: dict, device: BayrolPoolaccessDevice, discovery_prefix: str = "homeassistant"):
         self._uid = load_attr("uid", data)
         self._key = load_attr("key", data)
@@ -26,6 +29,7 @@ class Entity:
         self._device = device
         self._discovery_prefix = discovery_prefix
         self._lang = LanguageManager()
+        self._config = None
 
         # config variables
         self._attributes["unique_id"] = ("%s_%s_%s" % (norm(device.manufacturer), norm(self._device.id), self.key))
@@ -82,3 +86,10 @@ class Entity:
 
     def build_config(self):
         return "%s/config" % self.state_topic, {**self._attributes, "device": self._device}
+
+    def get_config(self) -> tuple[str, bytes]:
+        # config is static : serialize it only once
+        if self._config is None:
+            (topic, cfg) = self.build_config()
+            self._config = (topic, json_dumps(cfg))
+        return self._config
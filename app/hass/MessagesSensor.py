@@ -39,6 +39,8 @@ MESSAGES = {"8.5": {"key": "al_no_flow_bnc", "type": "warning"},
 
 
 class MessagesSensor(Sensor):
+    __slots__ = ("_messages",)
+
     def __init__(self, data: dict, device: BayrolPoolaccessDevice, dicovery_prefix: str = "homeassistant"):
         super().__init__(data, device, dicovery_prefix)
         # Build Messages array
@@ -4,6 +4,7 @@ from app.hass.Entity import Entity
 
 
 class Sensor(Entity):
+    __slots__ = ()
 
     def __init__(self, data: dict, device: BayrolPoolaccessDevice, dicovery_prefix: str = "homeassistant"):
         super().__init__(data, device, dicovery_prefix)
@@ -4,6 +4,8 @@ from app.hass.Entity import Entity
 
 
 class Switch(Entity):
+    __slots__ = ()
+
     def __init__(self, data: dict, device: BayrolPoolaccessDevice, dicovery_prefix: str = "homeassistant"):
         super().__init__(data, device, dicovery_prefix)
         data["payload_on"] = "on"
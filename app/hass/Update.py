@@ -6,6 +6,7 @@ from app.hass.Entity import Entity
 
 
 class Update(Entity):
+    __slots__ = ()
     ENTITY_PLATFORM = "update"
     BAYROL_UPDATE_URL = "https://www.denolle.fr/bayrol/update.json"
     BAYROL_SUPPORT_URL = "https://www.bayrol.fr/bayrol-technik-support"
@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 import logging
 from random import random
+from typing import Iterable
 
 import paho.mqtt.client as mqtt
 from paho.mqtt.enums import CallbackAPIVersion, MQTTErrorCode
 
 DEFAULT_MQTT_PORT = 1883
 DEFAULT_MQTT_KEEPALIVE = 60
-DEFAULT_RECONNECT_DELAY = 60
+MIN_RECONNECT_DELAY = 2
+MAX_RECONNECT_DELAY = 128
 
 
 class MqttClient(mqtt.Client):
@@ -23,6 +25,8 @@ class MqttClient(mqtt.Client):
         self._user = user
         self._pwd = password
         self._logger = logging.getLogger(__name__)
+        # Reconnect delay doubles on each attempt (2s to 128s) and is reset once connected
+        self.reconnect_delay_set(MIN_RECONNECT_DELAY, MAX_RECONNECT_DELAY)
         if self._user is not None:
             self.username_pw_set(
                 self._user,
@@ -35,3 +39,11 @@ class MqttClient(mqtt.Client):
             if self._logger is not None:
                 self._logger.error("Failed to connect to %s:%s. %s", self._host, self._port, e)
             return MQTTErrorCode.MQTT_ERR_CONN_REFUSED
+
+    def publish_batch(self, messages: Iterable[tuple]) -> list[mqtt.MQTTMessageInfo]:
+        """
+        Publish several messages, one publish() call per message : paho queues and sends each packet itself.
+        :param messages: Iterable of (topic, payload, qos, retain) tuples.
+        :return: The MQTTMessageInfo of each published message.
+        """
+        return [self.publish(topic, payload, qos, retain) for (topic, payload, qos, retain) in messages]
@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 
+import json
 import re
 import unicodedata
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 
 def normalize_string(string: str, sep: str = " "):
     """
@@ -26,3 +32,24 @@ def normalize_string(string: str, sep: str = " "):
         str_slugified = str_slugified.replace(" ", sep)
     return str_slugified.strip(sep)
 
+
+def json_dumps(obj) -> bytes:
+    """
+    Serialize an object to compact UTF-8 encoded JSON, using orjson when it is available.
+    :param obj: The object to serialize.
+    :return: The JSON bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_loads(data: bytes | str):
+    """
+    Deserialize a JSON document, using orjson when it is available.
+    :param data: The JSON document.
+    :return: The deserialized object.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,3 +1,4 @@
+import json
 import unittest
 
 from app.hass.BayrolPoolaccessDevice import BayrolPoolaccessDevice
@@ -16,6 +17,8 @@ class TestSensor(unittest.TestCase):
         self.assertEqual(sensor.key, "temperature")
         self.assertEqual(sensor.type, "sensor")
         self.assertEqual(sensor.name, "Temperature Sensor")
+        # attributes are stored in slots
+        self.assertFalse(hasattr(sensor, "__dict__"))
 
     def test_sensor_config(self):
         # Test building sensor configuration
@@ -41,6 +44,14 @@ class TestSensor(unittest.TestCase):
         self.assertEqual(config_topic, "homeassistant/sensor/22ASE-12343/temperature/config")
         self.assertEqual(config, expected_config)
 
+    def test_sensor_get_config(self):
+        sensor = Sensor(self.json_data, self.device)
+        config_topic, payload = sensor.get_config()
+        self.assertEqual(config_topic, "homeassistant/sensor/22ASE-12343/temperature/config")
+        self.assertEqual(json.loads(payload)["unique_id"], "bayrol_22ase12343_temperature")
+        # payload is serialized only once
+        self.assertIs(sensor.get_config()[1], payload)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -18,6 +18,8 @@ class TestSwitch(unittest.TestCase):
         self.assertEqual(switch.key, "sw_on_off")
         self.assertEqual(switch.type, "switch")
         self.assertEqual(switch.name, "Switch ON/OFF")
+        # attributes are stored in slots
+        self.assertFalse(hasattr(switch, "__dict__"))
 
 
     def test_switch_config(self):
@@ -1,9 +1,9 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, call
 
 from paho.mqtt.enums import MQTTErrorCode
 
-from app.mqtt.MqttClient import MqttClient
+from app.mqtt.MqttClient import MqttClient, MIN_RECONNECT_DELAY, MAX_RECONNECT_DELAY
 
 
 class TestMqttClient(unittest.TestCase):
@@ -30,6 +30,11 @@ class TestMqttClient(unittest.TestCase):
         MqttClient(self.host, self.port, self.user, self.password, self.transport)
         mock_username_pw_set.assert_called_once_with(self.user, self.password)
 
+    @patch('paho.mqtt.client.Client.reconnect_delay_set')
+    def test_init_reconnect_delay(self, mock_reconnect_delay_set):
+        MqttClient(self.host, self.port, self.user, self.password, self.transport)
+        mock_reconnect_delay_set.assert_called_once_with(MIN_RECONNECT_DELAY, MAX_RECONNECT_DELAY)
+
     @patch('paho.mqtt.client.Client.connect')
     def test_establish_connection(self, mock_connect):
         self.client.establish_connection()
@@ -55,6 +60,16 @@ class TestMqttClient(unittest.TestCase):
         self.client.publish("test_topic", "test_payload", 0, False)
         mock_publish.assert_called_once_with("test_topic", "test_payload", 0, False)
 
+    @patch('paho.mqtt.client.Client.publish')
+    def test_publish_batch(self, mock_publish):
+        infos = self.client.publish_batch([("topic_1", "payload_1", 0, True), ("topic_2", None, 1, False)])
+        mock_publish.assert_has_calls([call("topic_1", "payload_1", 0, True), call("topic_2", None, 1, False)])
+        self.assertEqual(len(infos), 2)
+
+    def test_publish_batch_not_connected(self):
+        infos = self.client.publish_batch([("topic_1", "payload_1", 0, True), ("topic_2", None, 0, False)])
+        self.assertEqual([i.rc for i in infos], [MQTTErrorCode.MQTT_ERR_NO_CONN, MQTTErrorCode.MQTT_ERR_NO_CONN])
+
     @patch('paho.mqtt.client.Client.subscribe')
     def test_subscribe(self, mock_subscribe):
         self.client.subscribe("test_topic", 0)
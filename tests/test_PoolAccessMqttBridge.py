@@ -1,9 +1,12 @@
 import os
+import threading
 import unittest
 from unittest.mock import MagicMock, patch, ANY, Mock, PropertyMock
 import json
 
-from paho.mqtt.client import MQTTMessage, MQTT_ERR_SUCCESS, MQTT_ERR_AUTH, MQTT_ERR_CONN_REFUSED
+from paho.mqtt.client import MQTTMessage
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
 
 from app.PoolAccessMqttBridge import PoolAccessMqttBridge, load_entities, main
 from app.hass.BayrolPoolaccessDevice import BayrolPoolaccessDevice
@@ -51,8 +54,6 @@ class TestPoolAccessMqttBridge(unittest.TestCase):
             self.poolaccess_client,
             self.brocker_client
         )
-        # avoid waiting for delay when reconnecting in connect loop
-        self.bridge._reconnect_delay = 0
 
     def test_init(self):
         self.assertEqual(self.bridge._poolaccess_device_serial, self.config["DEVICE_SERIAL"])
@@ -60,73 +61,97 @@ class TestPoolAccessMqttBridge(unittest.TestCase):
         self.assertEqual(self.bridge._hass_entities, self.entities)
         self.assertEqual(self.bridge._poolaccess_client, self.poolaccess_client)
         self.assertEqual(self.bridge._brocker_client, self.brocker_client)
+        self.assertEqual(self.bridge._switches, [self.entities[2]])
 
-    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge._multi_loop')
-    def test_start(self, mock_multi_loop):
+    def test_start(self):
         # Mock connect responses
         self.poolaccess_client.establish_connection.return_value = 0
         self.brocker_client.establish_connection.return_value = 0
 
         # Call start
-        self.bridge.start()
+        self.assertTrue(self.bridge.start())
 
         # Assert connect calls
         self.poolaccess_client.establish_connection.assert_called_once()
         self.brocker_client.establish_connection.assert_called_once()
 
-        mock_multi_loop.assert_called_once()
+        # Assert entities lookup tables passed as userdata
+        self.poolaccess_client.user_data_set.assert_called_once_with(self.bridge._by_uid)
+        self.brocker_client.user_data_set.assert_called_once_with(self.bridge._by_key)
 
-    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge._multi_loop')
-    def test_start_with_connection_errors(self, mock_multi_loop):
+        # Assert network loops startup
+        self.poolaccess_client.loop_start.assert_called_once()
+        self.brocker_client.loop_start.assert_called_once()
+        self.assertFalse(self.bridge.wait(0))
+
+    def test_start_with_connection_errors(self):
         # Mock connect responses
         self.poolaccess_client.establish_connection.return_value = 1
         self.brocker_client.establish_connection.return_value = 1
 
         # Call start
-        self.bridge.start()
+        self.assertFalse(self.bridge.start())
+        self.assertTrue(self.bridge.failed)
 
         # Assert connect calls
         self.poolaccess_client.establish_connection.assert_called_once()
         self.brocker_client.establish_connection.assert_called_once()
 
-        # Assert multi_loop not called
-        mock_multi_loop.assert_not_called()
-
-    def test_multi_loop_with_success(self):
-        # Mock connect responses
-        self.poolaccess_client.loop.return_value = MQTT_ERR_SUCCESS
-        self.brocker_client.loop.return_value = MQTT_ERR_SUCCESS
-
-        self.bridge._multi_loop(loop=False)
-        self.poolaccess_client.loop.assert_called_once()
-        self.brocker_client.loop.assert_called_once()
+        # Assert network loops not started
+        self.poolaccess_client.loop_start.assert_not_called()
+        self.brocker_client.loop_start.assert_not_called()
+        self.assertTrue(self.bridge.wait(0))
 
-    def test_multi_loop_with_connection_errors(self):
-        # Mock connect responses
-        self.poolaccess_client.loop.return_value = MQTT_ERR_AUTH
-        self.brocker_client.loop.return_value = MQTT_ERR_CONN_REFUSED
-        self.poolaccess_client.reconnect.side_effect = Exception('Poolaccess Test Exception')
-        self.brocker_client.reconnect.side_effect = Exception('Brocker Test Exception')
+    def test_stop(self):
+        message = MagicMock(spec=MQTTMessage)
+        message.topic = "d02/24ASE2-45678/v/123"
+        message.payload = b"{\"t\" : \"123\", \"v\" : \"255\"}"
+        self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
 
-        self.bridge._multi_loop(loop=False)
+        self.bridge.stop()
 
-        # loop calls
-        self.poolaccess_client.loop.assert_called_once()
-        self.brocker_client.loop.assert_called_once()
+        # pending states are published before disconnecting
+        self.brocker_client.publish_batch.assert_called_once()
+        self.assertIsNone(self.bridge._pending_timer)
+        self.poolaccess_client.disconnect.assert_called_once()
+        self.brocker_client.disconnect.assert_called_once()
+        self.poolaccess_client.loop_stop.assert_called_once()
+        self.brocker_client.loop_stop.assert_called_once()
+        self.assertTrue(self.bridge.wait(0))
 
-        # reconnect calls
-        self.poolaccess_client.reconnect.assert_called_once()
-        self.brocker_client.reconnect.assert_called_once()
+    def test_stop_with_message_received_while_stopping(self):
+        message = MagicMock(spec=MQTTMessage)
+        message.topic = "d02/24ASE2-45678/v/123"
+        message.payload = b"{\"t\" : \"123\", \"v\" : \"255\"}"
+        # poolaccess network thread delivers a last message before ending
+        self.poolaccess_client.loop_stop.side_effect = \
+            lambda: self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+        calls = MagicMock()
+        calls.attach_mock(self.poolaccess_client.disconnect, "pa_disconnect")
+        calls.attach_mock(self.poolaccess_client.loop_stop, "pa_loop_stop")
+        calls.attach_mock(self.brocker_client.publish_batch, "br_publish_batch")
+        calls.attach_mock(self.brocker_client.disconnect, "br_disconnect")
+        calls.attach_mock(self.brocker_client.loop_stop, "br_loop_stop")
+
+        self.bridge.stop()
+
+        # nothing is published once brocker is disconnected
+        self.assertEqual([c[0] for c in calls.mock_calls],
+                         ["pa_disconnect", "pa_loop_stop", "br_publish_batch", "br_disconnect", "br_loop_stop"])
+        self.assertIsNone(self.bridge._pending_timer)
 
     def test_on_poolaccess_message(self):
         message = MagicMock(spec=MQTTMessage)
         message.topic = "d02/24ASE2-45678/v/123"
         message.payload = b"{\"t\" : \"123\", \"v\" : \"255\"}"
-        self.bridge.on_poolaccess_message(self.poolaccess_client, None, message)
-        (self.brocker_client.publish
-         .assert_called_once_with("bayrol/sensor/24ASE2-45678/temperature", ANY, ANY, retain=True))
+        self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+        # Wait for coalesced states publication
+        self.bridge._pending_timer.join()
+        self.brocker_client.publish_batch.assert_called_once_with([
+            ("bayrol/sensor/24ASE2-45678/temperature", ANY, ANY, True)
+        ])
         # Check payload via args manually because of createdAt date value
-        payload = str(self.brocker_client.publish.call_args[0][1])
+        payload = str(self.brocker_client.publish_batch.call_args[0][0][0][1])
         self.assertIn("v", payload)
         self.assertIn("updatedAt", payload)
 
@@ -134,53 +159,161 @@ class TestPoolAccessMqttBridge(unittest.TestCase):
         message = MagicMock(spec=MQTTMessage)
         message.topic = "d02/24ASE2-45678/v/123"
         message.payload = b""
-        self.bridge.on_poolaccess_message(self.poolaccess_client, None, message)
-        self.brocker_client.publish.assert_called_once()
+        self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+        self.bridge._flush_pending()
+        self.brocker_client.publish_batch.assert_called_once_with([
+            ("bayrol/sensor/24ASE2-45678/temperature", None, ANY, True)
+        ])
 
     def test_on_poolaccess_message_with_no_payload(self):
         message = MagicMock(spec=MQTTMessage)
         message.topic = "d02/24ASE2-45678/v/123"
         message.payload = None
-        self.bridge.on_poolaccess_message(self.poolaccess_client, None, message)
-        self.brocker_client.publish.assert_not_called()
+        self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+        self.bridge._flush_pending()
+        self.brocker_client.publish_batch.assert_not_called()
 
     def test_on_poolaccess_message_with_malformed_payload(self):
         message = MagicMock(spec=MQTTMessage)
         message.topic = "d02/24ASE2-45678/v/123"
         message.payload = b"{"
-        self.bridge.on_poolaccess_message(self.poolaccess_client, None, message)
-        self.brocker_client.publish.assert_not_called()
+        self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+        self.bridge._flush_pending()
+        self.brocker_client.publish_batch.assert_not_called()
+
+    def test_on_poolaccess_message_with_unknown_uid(self):
+        message = MagicMock(spec=MQTTMessage)
+        message.topic = "d02/24ASE2-45678/v/1234"
+        message.payload = b"{\"t\" : \"1234\", \"v\" : \"255\"}"
+        self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+        self.bridge._flush_pending()
+        self.brocker_client.publish_batch.assert_not_called()
+
+    def test_on_poolaccess_message_with_other_device(self):
+        message = MagicMock(spec=MQTTMessage)
+        message.topic = "d02/24ASE2-00000/v/123"
+        message.payload = b"{\"t\" : \"123\", \"v\" : \"255\"}"
+        self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+        self.bridge._flush_pending()
+        self.brocker_client.publish_batch.assert_not_called()
+
+    def test_on_poolaccess_message_coalesced(self):
+        for (topic, v) in (("d02/24ASE2-45678/v/123", "255"),
+                           ("d02/24ASE2-45678/v/456", "72"),
+                           ("d02/24ASE2-45678/v/123", "256")):
+            message = MagicMock(spec=MQTTMessage)
+            message.topic = topic
+            message.payload = ("{\"v\" : \"%s\"}" % v).encode()
+            self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+        self.bridge._flush_pending()
+        # a single publication per entity, holding its last value
+        messages = self.brocker_client.publish_batch.call_args[0][0]
+        self.assertEqual([m[0] for m in messages],
+                         ["bayrol/sensor/24ASE2-45678/temperature", "bayrol/sensor/24ASE2-45678/ph"])
+        self.assertEqual(json.loads(messages[0][1])["v"], "256")
+        self.assertIsNone(self.bridge._pending_timer)
 
     def test_on_brocker_message(self):
         message = MagicMock(spec=MQTTMessage)
         message.topic = "bayrol/switch/24ASE2-45678/ph_switch/set"
         message.payload = b"{\"v\" : \"on\"}"
-        self.bridge.on_brocker_message(self.brocker_client, None, message)
+        self.bridge.on_brocker_message(self.brocker_client, self.bridge._by_key, message)
         (self.poolaccess_client.publish
          .assert_called_once_with("d02/24ASE2-45678/s/789", payload=b'{"v" : "on"}'))
 
+    def test_on_brocker_message_drops_older_pending_state(self):
+        message = MagicMock(spec=MQTTMessage)
+        message.topic = "d02/24ASE2-45678/v/789"
+        message.payload = b"{\"v\" : \"off\"}"
+        self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+
+        message = MagicMock(spec=MQTTMessage)
+        message.topic = "bayrol/switch/24ASE2-45678/ph_switch/set"
+        message.payload = b"{\"v\" : \"on\"}"
+        self.bridge.on_brocker_message(self.brocker_client, self.bridge._by_key, message)
+        self.bridge._flush_pending()
+
+        # the command is the last state published to brocker
+        (self.brocker_client.publish
+         .assert_called_once_with("bayrol/switch/24ASE2-45678/ph_switch", payload=b'{"v" : "on"}', retain=True))
+        self.brocker_client.publish_batch.assert_not_called()
+
+    def test_on_brocker_message_during_flush(self):
+        message = MagicMock(spec=MQTTMessage)
+        message.topic = "d02/24ASE2-45678/v/789"
+        message.payload = b"{\"v\" : \"off\"}"
+        self.bridge.on_poolaccess_message(self.poolaccess_client, self.bridge._by_uid, message)
+
+        # a command received while the pending states are being flushed waits for the flush to be published
+        command = MagicMock(spec=MQTTMessage)
+        command.topic = "bayrol/switch/24ASE2-45678/ph_switch/set"
+        command.payload = b"{\"v\" : \"on\"}"
+        calls = []
+        publish_batch_started = threading.Event()
+        release_publish_batch = threading.Event()
+
+        def publish_batch(messages):
+            publish_batch_started.set()
+            release_publish_batch.wait(1)
+            calls.append("publish_batch")
+
+        self.brocker_client.publish_batch.side_effect = publish_batch
+        self.brocker_client.publish.side_effect = lambda *args, **kwargs: calls.append("publish")
+        flush = threading.Thread(target=self.bridge._flush_pending)
+        flush.start()
+        publish_batch_started.wait(1)
+        command_thread = threading.Thread(target=self.bridge.on_brocker_message,
+                                          args=(self.brocker_client, self.bridge._by_key, command))
+        command_thread.start()
+        command_thread.join(0.1)
+        release_publish_batch.set()
+        flush.join()
+        command_thread.join()
+
+        # the command is the last state published to brocker
+        self.assertEqual(calls, ["publish_batch", "publish"])
+
     def test_on_brocker_message_with_not_set(self):
         message = MagicMock(spec=MQTTMessage)
         message.topic = "bayrol/switch/24ASE2-45678/ph_switch"
         message.payload = None
-        self.bridge.on_brocker_message(self.brocker_client, None, message)
+        self.bridge.on_brocker_message(self.brocker_client, self.bridge._by_key, message)
         self.poolaccess_client.publish.assert_not_called()
 
     def test_on_brocker_message_with_no_command_set(self):
         message = MagicMock(spec=MQTTMessage)
         message.topic = "bayrol/switch/24ASE2-45678/ph_switch"
         message.payload = "{}"
-        self.bridge.on_brocker_message(self.brocker_client, None, message)
+        self.bridge.on_brocker_message(self.brocker_client, self.bridge._by_key, message)
+        self.poolaccess_client.publish.assert_not_called()
+
+    def test_on_brocker_message_with_unknown_key(self):
+        message = MagicMock(spec=MQTTMessage)
+        message.topic = "bayrol/switch/24ASE2-45678/unknown_switch/set"
+        message.payload = b"{\"v\" : \"on\"}"
+        self.bridge.on_brocker_message(self.brocker_client, self.bridge._by_key, message)
         self.poolaccess_client.publish.assert_not_called()
 
+    def test_on_brocker_message_with_set_only(self):
+        message = MagicMock(spec=MQTTMessage)
+        message.topic = "/set"
+        message.payload = b"{\"v\" : \"on\"}"
+        self.bridge.on_brocker_message(self.brocker_client, self.bridge._by_key, message)
+        self.poolaccess_client.publish.assert_not_called()
+        self.brocker_client.publish.assert_not_called()
+
     def test_on_poolaccess_connect(self):
         self.bridge.on_poolaccess_connect(None, None, None, 0, None)
-        self.poolaccess_client.publish.assert_has_calls([
-            unittest.mock.call("d02/24ASE2-45678/g/123", payload=None),
-            unittest.mock.call("d02/24ASE2-45678/g/456", payload=None)
+        self.poolaccess_client.publish_batch.assert_called_once_with([
+            ("d02/24ASE2-45678/g/123", None, 0, False),
+            ("d02/24ASE2-45678/g/456", None, 0, False),
+            ("d02/24ASE2-45678/g/789", None, 0, False)
         ])
-        self.brocker_client.publish.assert_has_calls([
-            unittest.mock.call('bayrol/sensor/24ASE2-45678/temperature/config', payload=json.dumps({
+        self.brocker_client.publish_batch.assert_called_once()
+        brocker_messages = self.brocker_client.publish_batch.call_args[0][0]
+        self.assertEqual(len(brocker_messages), 3)
+        self.assertEqual([(t, json.loads(p), q, r) for (t, p, q, r) in brocker_messages[:2]], [
+            ('bayrol/sensor/24ASE2-45678/temperature/config', {
                 "name": "Température",
                 "unique_id": "bayrol_24ase245678_temperature",
                 "object_id": "bayrol_24ase245678_temperature",
@@ -189,8 +322,8 @@ class TestPoolAccessMqttBridge(unittest.TestCase):
                                   "value_template": "{{ \'online\' if value_json.v | float > 17.0 else \'offline\' }}"}],
                 "value_template": "{{ value_json.v }}",
                 "device": self.device
-            }), retain=True),
-            unittest.mock.call('bayrol/sensor/24ASE2-45678/ph/config', payload=json.dumps({
+            }, 0, True),
+            ('bayrol/sensor/24ASE2-45678/ph/config', {
                 "name": "pH",
                 "unique_id": "bayrol_24ase245678_ph",
                 "object_id": "bayrol_24ase245678_ph",
@@ -199,24 +332,39 @@ class TestPoolAccessMqttBridge(unittest.TestCase):
                                   "value_template": "{{ \'online\' if value_json.v | float > 17.0 else \'offline\' }}"}],
                 "value_template": "{{ value_json.v }}",
                 "device": self.device
-            }), retain=True)
+            }, 0, True)
         ])
         self.poolaccess_client.subscribe.assert_called_once_with("d02/24ASE2-45678/v/#")
 
     def test_on_brocker_connect(self):
         self.bridge.on_brocker_connect(self.brocker_client, None, None, 0, None)
+        self.brocker_client.subscribe.assert_called_once_with([("bayrol/switch/24ASE2-45678/ph_switch/set", 0)])
+
+    def test_on_brocker_connect_without_switch(self):
+        bridge = PoolAccessMqttBridge(self.config["MQTT_BASE_TOPIC"], self.config["DEVICE_SERIAL"], self.entities[:2],
+                                      self.poolaccess_client, self.brocker_client)
+        bridge.on_brocker_connect(self.brocker_client, None, None, 0, None)
+        self.brocker_client.subscribe.assert_not_called()
 
     def test_on_brocker_connect_failed(self):
-        with self.assertRaises(SystemExit) as se:
-            self.bridge.on_brocker_connect(self.brocker_client, None, None, 1, None)
-        e = se.exception
-        self.assertEqual(e.code, 1)
+        rc = ReasonCode(PacketTypes.CONNACK, "Not authorized")
+        self.bridge.on_brocker_connect(self.brocker_client, None, None, rc, None)
+        self.assertTrue(self.bridge.wait(0))
+        self.assertTrue(self.bridge.failed)
 
     def test_on_poolaccess_connect_failed(self):
-        with self.assertRaises(SystemExit) as se:
-            self.bridge.on_poolaccess_connect(self.poolaccess_client, None, None, 1, None)
-        e = se.exception
-        self.assertEqual(e.code, 1)
+        rc = ReasonCode(PacketTypes.CONNACK, "Bad user name or password")
+        self.bridge.on_poolaccess_connect(self.poolaccess_client, None, None, rc, None)
+        self.assertTrue(self.bridge.wait(0))
+        self.assertTrue(self.bridge.failed)
+
+    def test_on_connect_failed_transient(self):
+        # paho retries with its reconnect backoff : the bridge keeps running
+        rc = ReasonCode(PacketTypes.CONNACK, "Server unavailable")
+        self.bridge.on_brocker_connect(self.brocker_client, None, None, rc, None)
+        self.bridge.on_poolaccess_connect(self.poolaccess_client, None, None, rc, None)
+        self.assertFalse(self.bridge.wait(0))
+        self.assertFalse(self.bridge.failed)
 
     def test_on_poolaccess_disconnect(self):
         c = PoolAccessClient("__token__")
@@ -224,22 +372,36 @@ class TestPoolAccessMqttBridge(unittest.TestCase):
         c._do_on_disconnect(False, None)
         assert self.bridge.on_disconnect
 
+    def test_on_disconnect_normal(self):
+        with self.assertLogs(level="INFO") as logs:
+            self.bridge.on_disconnect(self.brocker_client, None, None, 0, None)
+        self.assertNotIn("reconnecting", logs.output[0])
+        self.assertTrue(logs.output[0].startswith("INFO"))
+
+    def test_on_disconnect_unexpected(self):
+        with self.assertLogs(level="INFO") as logs:
+            self.bridge.on_disconnect(self.brocker_client, None, None, 7, None)
+        self.assertIn("reconnecting", logs.output[0])
+        self.assertTrue(logs.output[0].startswith("WARNING"))
+
     def test_load_sensors(self):
         # Mock entities.json file
         entities_json_path = os.path.join(os.path.dirname(__file__), "entities.json")
         with open(entities_json_path, 'w') as f:
             json.dump([
-                {"uid": "1", "key": "temperature", "unit_of_measurement": "°C", "attr_dyn" : "#XXX/#DEVICE_SERIAL/on"},
+                {"uid": "1", "key": "temperature", "unit_of_measurement": "°C", "attr_dyn" : "#XXX/#DEVICE_SERIAL/on",
+                 "attr_prefix": "#XXX_LONG/#XXX"},
                 {"uid": "10", "key": "messages", "__class__": "MessagesSensor"},
                 {"uid": "15", "key": "se_on_off", "__class__": "Switch"}
             ], f)
 
         # Load entities
-        entities = load_entities(entities_json_path, { "DEVICE_SERIAL" : "1.0", "XXX" : "YYY" })
+        entities = load_entities(entities_json_path, { "DEVICE_SERIAL" : "1.0", "XXX" : "YYY", "XXX_LONG": "ZZZ" })
 
         # Assert sensor types
         self.assertIsInstance(entities[0], Sensor)
         self.assertEqual(entities[0].get_attr("attr_dyn"),"YYY/1.0/on")
+        self.assertEqual(entities[0].get_attr("attr_prefix"), "ZZZ/YYY")
 
         self.assertIsInstance(entities[1], MessagesSensor)
         self.assertIsInstance(entities[2], Switch)
@@ -247,10 +409,49 @@ class TestPoolAccessMqttBridge(unittest.TestCase):
         # Clean up
         os.remove(entities_json_path)
 
+    def test_load_sensors_with_unknown_class(self):
+        # Mock entities.json file
+        entities_json_path = os.path.join(os.path.dirname(__file__), "entities.json")
+        with open(entities_json_path, 'w') as f:
+            json.dump([{"uid": "15", "key": "se_on_off", "__class__": "Unknown"}], f)
+
+        with self.assertRaises(KeyError):
+            load_entities(entities_json_path, {"DEVICE_SERIAL": "1.0"})
+
+        # Clean up
+        os.remove(entities_json_path)
+
+    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.stop')
+    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.wait')
     @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.start')
-    def test_main(self, mock_start):
+    def test_main(self, mock_start, mock_wait, mock_stop):
         main(self.config)
         mock_start.assert_called_once()
+        mock_wait.assert_called_once()
+        mock_stop.assert_called_once()
+
+    @patch('app.PoolAccessMqttBridge.load_entities')
+    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.stop')
+    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.wait')
+    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.start')
+    def test_main_interrupted(self, mock_start, mock_wait, mock_stop, mock_load_entities):
+        mock_load_entities.return_value = self.entities
+        mock_wait.side_effect = KeyboardInterrupt()
+        main(self.config)
+        mock_stop.assert_called_once()
+
+    @patch('app.PoolAccessMqttBridge.load_entities')
+    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.stop')
+    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.wait')
+    @patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.start')
+    def test_main_failed(self, mock_start, mock_wait, mock_stop, mock_load_entities):
+        mock_load_entities.return_value = self.entities
+        with patch('app.PoolAccessMqttBridge.PoolAccessMqttBridge.failed', new_callable=PropertyMock) as mock_failed:
+            mock_failed.return_value = True
+            with self.assertRaises(SystemExit) as se:
+                main(self.config)
+        self.assertEqual(se.exception.code, 1)
+        mock_stop.assert_called_once()
 
 
 if __name__ == '__main__':
@@ -1,6 +1,8 @@
 import unittest
 
-from app.utils.Utils import normalize_string
+from unittest.mock import patch
+
+from app.utils.Utils import normalize_string, json_dumps, json_loads
 
 
 class TestUtils(unittest.TestCase):
@@ -40,5 +42,23 @@ class TestUtils(unittest.TestCase):
         expected_output = "this-is-a-test-with-special-characters"
         self.assertEqual(normalize_string(input_string,"-"), expected_output)
 
+    def test_json_dumps(self):
+        self.assertEqual(json_dumps({"name": "Température", "v": [1, 2]}),
+                         '{"name":"Température","v":[1,2]}'.encode())
+
+    @patch('app.utils.Utils.orjson', None)
+    def test_json_dumps_without_orjson(self):
+        self.assertEqual(json_dumps({"name": "Température", "v": [1, 2]}),
+                         '{"name":"Température","v":[1,2]}'.encode())
+
+    def test_json_loads(self):
+        self.assertEqual(json_loads(b'{"v": [1, 2]}'), {"v": [1, 2]})
+        self.assertEqual(json_loads('{"v": "Température"}'), {"v": "Température"})
+
+    @patch('app.utils.Utils.orjson', None)
+    def test_json_loads_without_orjson(self):
+        self.assertEqual(json_loads(b'{"v": [1, 2]}'), {"v": [1, 2]})
+
+
 if __name__ == '__main__':
     unittest.main()